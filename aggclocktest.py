@@ -10,47 +10,111 @@ import pandas as pd
 import numpy as np
 import decispy as dec
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 repo = dec.git.Session()
 
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def seg_sum_count(values, segments, out_sum, out_cnt):
+        # sum (with min_count=1) and count non-null values for each contiguous segment in one pass.
+        # Unlike pandas' groupby.sum this is a plain (not Kahan-compensated) sum, so results can differ
+        # from the pandas fallback in the last digits
+        for g in prange(len(segments)-1):
+            acc = 0.0
+            c = 0
+            for i in range(segments[g], segments[g+1]):
+                v = values[i]
+                if not np.isnan(v):
+                    acc += v
+                    c += 1
+
+            out_sum[g] = acc if c >= 1 else np.nan
+            out_cnt[g] = c
+
+def group_sum_count(agg, cols):
+    '''Return the sums (min_count=1) and counts of cols in agg grouped by its categorical time and region columns
+    '''
+
+    if njit is None:
+        # both reductions share one grouper, so the group keys are only factorized once
+        g = agg.groupby(['time', 'region'], observed=True, sort=False)[cols]
+        return (g.sum(min_count=1), g.count())
+
+    # sort once by the combined category codes; each group is then a contiguous segment
+    time = agg['time'].cat
+    region = agg['region'].cat
+    key = time.codes.to_numpy(dtype=np.int64) * len(region.categories) + region.codes.to_numpy(dtype=np.int64)
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    first = np.r_[0, np.flatnonzero(np.diff(sorted_key)) + 1]
+    keys = sorted_key[first]
+    segments = np.append(first, len(key))
+
+    index = pd.MultiIndex.from_arrays([
+        pd.Categorical.from_codes(keys // len(region.categories), dtype=agg['time'].dtype),
+        pd.Categorical.from_codes(keys % len(region.categories), dtype=agg['region'].dtype)
+    ], names=['time', 'region'])
+
+    sums = {}
+    counts = {}
+    for col in cols:
+        sums[col] = np.empty(len(keys), dtype=np.float64)
+        counts[col] = np.empty(len(keys), dtype=np.int64)
+        seg_sum_count(agg[col].to_numpy(dtype=np.float64)[order], segments, sums[col], counts[col])
+
+    return (pd.DataFrame(sums, index=index), pd.DataFrame(counts, index=index))
+
 # reverse engineer a list of indicators from the working directory
-cets_list = []
-for root,dirs,files in os.walk('data'):
-  for elem in files:
-    (base,ext) = os.path.splitext(elem)
-    if ext.lower() == '.csv':
-      cets_list.append(base)
+cets_list = [elem[:-4] for root,dirs,files in os.walk('data') for elem in files if elem.lower().endswith('.csv')]
 
 regions = pd.read_csv('regions.csv').set_index(['region','country']).drop('type', axis=1)
 
+# keep the join and group keys categorical so that pandas can match and group on integer codes
+# rather than hashing strings on every iteration. Economies not in regions.csv become NaN, which
+# excludes them from regional aggregates but not from WLD
+region_dtype = pd.CategoricalDtype(regions.index.get_level_values('region').unique())
+country_dtype = pd.CategoricalDtype(regions.index.get_level_values('country').unique())
+
+# we need to create a left-side data frame keyed by time (from the data), region and country (from regions)
+# this only depends on the time periods, which most indicators share, so we memoize it by time periods
+templates = {}
+
 start = datetime.now()
 for elem in cets_list:
     print('Processing: {}'.format(elem))
 
     df = repo.load([elem]).assign(N=1)
-    time_periods = df.index.get_level_values('time').unique()
-    
-    # we need to create a left-side data frame keyed by time (from the data), region and country (from regions)
-    # this will have len(regions) * len(time_periods) rows
+    time_periods = tuple(sorted(df.index.get_level_values('time').unique()))
+
+    if time_periods not in templates:
+        # create a dictionary of keys (time periods) and corresponding data frames; in this case,
+        # the same (blank) data frame for each time period. This will have len(regions) * len(time_periods) rows
+        i = {t:regions for t in time_periods}
+        master = pd.concat(i, keys=time_periods, names=['time']).reset_index()
+        templates[time_periods] = master.astype({'time': pd.CategoricalDtype(time_periods), 'region': region_dtype, 'country': country_dtype})
 
-    # create a dictionary of keys (time periods) and corresponding data frames; in this case,
-    # the same (blank) data frame for each time period
-    i = {t:regions for t in time_periods}
-    master = pd.concat(i, keys=time_periods, names=['time']).reset_index()
+    master = templates[time_periods]
+    df.index = pd.MultiIndex.from_arrays([
+        pd.Categorical(df.index.get_level_values('time'), dtype=master['time'].dtype),
+        pd.Categorical(df.index.get_level_values('economy'), dtype=country_dtype)
+    ], names=df.index.names)
 
     agg = master.join(df, on=['time', 'country'])
 
-    a1 = agg.groupby(['time', 'region']).sum(min_count=1)
+    (a1, mask_values) = group_sum_count(agg, [elem, 'N'])
 
     # FIXME
-    # add WLD aggregates
-    wld = df.groupby('time').sum(min_count=1).assign(region='WLD').set_index('region', append=True)
-    a1 = a1.append(wld).sort_index()
-
-    # calculate mask values
-    mask_values = agg.groupby(['time', 'region']).count()
+    # add WLD aggregates and mask values
+    g = df.groupby('time', observed=True, sort=False)
+    wld = g.sum(min_count=1).assign(region='WLD').set_index('region', append=True)
+    a1 = pd.concat([a1, wld]).sort_index()
 
-    wld = df.groupby('time').count().assign(region='WLD').set_index('region', append=True)
-    mask_values = mask_values.append(wld).sort_index()
+    wld = g.count().assign(region='WLD').set_index('region', append=True)
+    mask_values = pd.concat([mask_values, wld]).sort_index()
 
     a1.loc[(mask_values[elem]/mask_values['N'])<0.6, elem] = np.nan
     a1.index.rename('economy', 'region', inplace=True)
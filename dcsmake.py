@@ -10,45 +10,54 @@ Usage:
 
 import pandas as pd
 import os
+import importlib.util
 from docopt import docopt
 
+# use the multithreaded pyarrow CSV parser where available. pandas supports the pyarrow engine from 1.4
+if importlib.util.find_spec('pyarrow') and tuple(int(x) for x in pd.__version__.split('.')[:2]) >= (1, 4):
+    csv_engine = 'pyarrow'
+else:
+    csv_engine = None
+
+def read_csv(path):
+    df = pd.read_csv(path, engine=csv_engine)
+
+    # the pyarrow engine reads an entirely empty column as object/None rather than float64 NaN
+    if df['value'].dtype == object and df['value'].isna().all():
+        df['value'] = df['value'].astype('float64')
+
+    return df
+
 config = docopt(__doc__)
 
-master = None
+master_frames = []
 # it's hard in pandas to append or concat a bunch of relatively small dataframes
 # into a large one efficiently, it's always reallocating and copying memory
-# To boost speed, we aggregate one dirctory at a time and than append to the master
-# which should result in a lot fewer in-memory copy operations of the master frame
+# To boost speed, we collect frames in lists and concatenate each directory once,
+# then the master once at the end, so each row is only copied a couple of times
 for path in config['PATH']:
     if os.path.isdir(path):
         for root,dirs,files in os.walk(path):
-            sd = None
+            sd_frames = []
             # aggregate the subdirectory to a single data frame
             for i in files:
-                (base,ext) = os.path.splitext(i)
-                if ext.lower() == '.csv':
+                if i.lower().endswith('.csv'):
                     fullpath = '{}/{}'.format(root, i)
                     print('Reading {}'.format(fullpath))
-                    df = pd.read_csv(fullpath)
-                    df.insert(0, 'series', base)
-                    if sd is None:
-                        sd = df
-                    else:
-                        sd = sd.append(df)
-
-            # now copy the sub-directory frame to the master
-            if master is None:
-                master = sd
-            elif sd is not None:
-                master = master.append(sd)
+                    df = read_csv(fullpath)
+                    df.insert(0, 'series', i[:-4])
+                    sd_frames.append(df)
+
+            # now add the sub-directory frame to the master list
+            if sd_frames:
+                master_frames.append(pd.concat(sd_frames, ignore_index=True, copy=False))
     else:
-        (base,ext) = os.path.splitext(os.path.basepath(path))
-        df = pd.read_csv(path)
+        (base,ext) = os.path.splitext(os.path.basename(path))
+        df = read_csv(path)
         df.insert(0, 'series', base)
-        if master is None:
-            df = master
-        else:
-            master = master.append(df)
+        master_frames.append(df)
+
+master = pd.concat(master_frames, ignore_index=True, copy=False)
 
 # transform
 print('Writing {} '.format(config['EXCEL']), end='', flush=True)
@@ -57,14 +66,14 @@ master.insert(0, 'SCALE', 0)
 master.sort_index(inplace=True)
 master.reset_index(inplace=True)
 
-# create and insert 2 header columns by hand
-columns = list(master.columns)
-columns[0:3] = ['', '', 'Time']
+# write the 2 header rows by hand above the data, rather than inserting them into the frame
+header = pd.DataFrame([
+    ['', '', 'Time'] + list(master.columns[3:]),
+    ['Country', 'Series', 'SCALE'] + ([''] * (len(master.columns)-3))
+])
 
-master.loc[-2] = columns
-master.loc[-1] = ['Country', 'Series', 'SCALE'] + ([''] * (len(master.columns)-3))
-
-master.sort_index(inplace=True)
+with pd.ExcelWriter(config['EXCEL']) as writer:
+    header.to_excel(writer, index=False, header=False)
+    master.to_excel(writer, index=False, header=False, startrow=2)
 
-master.to_excel(config['EXCEL'], index=False, header=False)
 print('')
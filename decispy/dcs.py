@@ -10,6 +10,7 @@ Usage:
 '''
 
 import pandas as pd
+import numpy as np
 import sys
 
 def read(fp):
@@ -62,9 +63,9 @@ def translate_bulk_to_long(df):
 
   df.drop(['Country Name', 'Indicator Name'], axis=1, inplace=True)
   df.rename({'Country Code': 'economy', 'Indicator Code': 'series'}, axis=1, inplace=True)
-  df = df.melt(id_vars=df.columns[:2], value_vars=df.columns[2:], var_name='time')
-  df['time'] = df['time'].apply(lambda x: 'YR' + str(x))
-  return df
+  # prefix the year columns before reshaping so we only build each label once
+  df.columns = list(df.columns[:2]) + ['YR' + str(x) for x in df.columns[2:]]
+  return unpivot(df, 2)
 
     
 def translate_to_long(df):
@@ -84,7 +85,21 @@ def translate_to_long(df):
   df.drop('Time', axis=1, inplace=True)
 
   # pivot columns at or to the right of what previously was the time column
-  return standardize(df.melt(id_vars=df.columns[:p], value_vars=df.columns[p:], var_name='time'))
+  return standardize(unpivot(df, p))
+
+def unpivot(df, n, var_name='time', value_name='value'):
+  '''Unpivot a data frame from wide to long format, treating the first n columns as identifiers.
+     Equivalent to df.melt, but reshapes the value block directly instead of copying it column by column
+  '''
+
+  vals = df.iloc[:, n:].to_numpy()
+  (rows, cols) = vals.shape
+
+  # column-major order matches df.melt: all rows for the 1st value column, then the 2nd, etc
+  out = {df.columns[i]: np.tile(df.iloc[:, i].to_numpy(), cols) for i in range(n)}
+  out[var_name] = np.repeat(df.columns[n:].to_numpy(), rows)
+  out[value_name] = vals.ravel(order='F')
+  return pd.DataFrame(out)
 
 def standardize(df):
   '''Drop and rename DCS columns to standards
@@ -6,7 +6,10 @@ import pandas as pd
 import numpy as np
 import io
 import os
+import re
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import yaml
 from .util import init_view
 
@@ -15,6 +18,75 @@ try:
 except ImportError:
     pygit = None
 
+# use the multithreaded pyarrow CSV parser and writer where available. pandas supports the pyarrow engine from 1.4
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pcsv
+    csv_engine = 'pyarrow' if tuple(int(x) for x in pd.__version__.split('.')[:2]) >= (1, 4) else None
+except ImportError:
+    pa = None
+    csv_engine = None
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import bottleneck as bn
+except ImportError:
+    bn = None
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _is_integral(v):
+        # single pass that bails out on the first fractional value
+        for x in v:
+            if not (np.isnan(x) or x % 1.0 == 0.0):
+                return False
+
+        return True
+
+elif bn is not None:
+    def _is_integral(v):
+        # remainders are never negative and NaN for missing values, so they are all zero exactly
+        # when their NaN-skipping sum is. This saves the isnan mask and the OR of two boolean arrays
+        return not bn.nansum(np.remainder(v, 1))
+
+else:
+    def _is_integral(v):
+        return bool(((np.remainder(v, 1) == 0) | np.isnan(v)).all())
+
+
+def _read_csv(fp):
+    df = pd.read_csv(fp, engine=csv_engine)
+
+    # the pyarrow engine reads an entirely empty column as object/None rather than float64 NaN
+    if 'value' in df.columns and df['value'].dtype == object and df['value'].isna().all():
+        df['value'] = df['value'].astype('float64')
+
+    return df
+
+
+def format_str(s):
+    '''Return a float format string suitable for writing the series to CSV, or None for the default
+    '''
+
+    # pandas is sloppy about decimal points and integer values frequently get written as floats
+    # we try to correct for this by looking for remainders and if none, we specify a formatting string
+    if _is_integral(s.to_numpy(dtype='float64', copy=False)):
+        return '%.0f'
+
+    return None
+
+
 class Session():
 
     def __init__(self, path='.'):
@@ -27,10 +99,25 @@ class Session():
         init_view(path)
         self.line_terminator = None
 
+        # I/O buffer size for writing CSV files
+        self.buffer_size = 1 << 20
+
+        # cache a parquet copy of each CSV read from the working directory, and read it in preference to the CSV
+        # while the CSV's size and mtime still match. CSVs remain the canonical (tracked) format; parquet files
+        # are an untracked local cache
+        self.parquet = pa is not None and pq is not None
+
         # keys sets the key columns and order within a CSV file. These can be customized for subnational or additional dimensions
         self.keys = ['time', 'economy']
         self.values = {}
 
+        # float format strings for known series, by CETS code. Series listed under integer_series in
+        # config.yaml are always written as integers, skipping the scan for fractional values
+        self.formats = {}
+
+        # nearest commits for (commit sha, path) pairs, as found by commit_for_path
+        self.commits = {}
+
         # load parameters from yaml if present
         config_path = os.path.join(path, 'config.yaml')
         if os.path.exists(config_path):
@@ -39,6 +126,11 @@ class Session():
                 for k,v in config.items():
                     if k == 'keys':
                         self.keys = v
+                    elif k == 'integer_series':
+                        if type(v) is not list:
+                            raise ValueError('integer_series must be a list in config.yaml')
+
+                        self.formats.update({str(id).upper(): '%.0f' for id in v})
                     else:
                         self.values[k] = v
 
@@ -100,24 +192,15 @@ class Session():
            simplify: convert paths to system IDs (e.g. CETS codes). changes will be limited to CSV files
         '''
 
-        repo = self.repo
-        files = []
-        if prefix:
-            prefix += '/'
-
-        for row in repo.git.status('--short').split('\n'):
-            # currently only report files marked as 'modified' not added, deleted, moved etc
-            if 'M' in row[0:2]:
-                path = row[3:]
-                if prefix is None or path.startswith(prefix):
-                    if simplify:
-                        (base,ext) = os.path.splitext(os.path.basename(path))
-                        if ext.lower() == '.csv':
-                            files.append(base)
-                    else:
-                        files.append(path)
+        prefix = re.escape(prefix + '/') if prefix else ''
 
-        return files
+        # currently only report files marked as 'modified' (in either status column) not added, deleted, moved etc
+        if simplify:
+            pattern = r'^(?:.M|M.) {}(?:.*/)?([^/\n]+)\.(?i:csv)$'.format(prefix)
+        else:
+            pattern = r'^(?:.M|M.) ({}.*)$'.format(prefix)
+
+        return re.findall(pattern, self.repo.git.status('--short', '--untracked-files=no'), re.M)
 
 
     def read_csv(self, path, ref=None):
@@ -131,9 +214,38 @@ class Session():
             c = self.commit_for_path(ref, path)
             if c:
                 buf = io.BytesIO(c.tree[path].data_stream.read())
-                return pd.read_csv(buf)
+                return _read_csv(buf)
         else:
-            return pd.read_csv(path)
+            if not self.parquet:
+                return _read_csv(path)
+
+            # only trust the copy if it was made from the CSV as it is now. The stamp is taken before
+            # parsing, so a CSV that changes while we read it won't match next time either
+            cache = self.parquet_path(path)
+            stamp = self.csv_stamp(path)
+            if os.path.exists(cache):
+                metadata = pq.read_schema(cache).metadata or {}
+                if all(metadata.get(k) == v for k,v in stamp.items()):
+                    return pq.read_table(cache).to_pandas(split_blocks=True, self_destruct=True)
+
+            df = _read_csv(path)
+            self.write_parquet(df, cache, stamp)
+            return df
+
+
+    def parquet_path(self, path):
+        '''Return the path of the parquet copy of a CSV file
+        '''
+
+        return os.path.splitext(path)[0] + '.parquet'
+
+
+    def csv_stamp(self, path):
+        '''Return the size and modification time of a CSV file, as stored in the metadata of its parquet copy
+        '''
+
+        st = os.stat(path)
+        return {b'csv_size': str(st.st_size).encode(), b'csv_mtime_ns': str(st.st_mtime_ns).encode()}
 
 
     def load(self, id, prefix='data', ref=None, long=False):
@@ -152,6 +264,10 @@ class Session():
         '''
 
         if type(id) is not str:
+            if ref:
+                # resolve the ref once rather than for every series
+                ref = self.repo.commit(ref).hexsha
+
             if long:
                 series = []
                 for elem in id:
@@ -162,15 +278,25 @@ class Session():
                 return s
 
             else:
-                df = None
-                for elem in id:
-                    s = self.load(elem, prefix=prefix, ref=ref, long=False).rename(elem)
-                    if df is None:
-                        df = pd.DataFrame(s)
-                    else:
-                        df =  df.join(s, how='outer')
+                def load_series(elem):
+                    return self.load(elem, prefix=prefix, ref=ref, long=False)
+
+                id = list(id)
+                if ref or len(id) == 1:
+                    # GitPython's object database is not thread safe, so reads from commits stay sequential.
+                    # A single series isn't worth starting a thread pool for either
+                    series = list(map(load_series, id))
+                else:
+                    with ThreadPoolExecutor() as executor:
+                        series = list(executor.map(load_series, id))
+
+                if not series:
+                    return None
 
-                return df
+                # a single outer alignment across all series, rather than a chain of joins. Keys name the
+                # columns so the series don't need to be renamed (and copied) first, and sort=True keeps
+                # the sorted index that outer joins produce
+                return pd.concat(series, keys=id, axis=1, join='outer', sort=True, copy=False)
                 
         # else we should return a pandas.Series
         id = id.upper()
@@ -190,10 +316,13 @@ class Session():
         '''Return the nearest commit that contains the specified object
         '''
 
-        for elem in self.repo.iter_commits(self.repo.commit(ref), paths=path):
-            return elem
+        # resolve the ref first so that cached results don't go stale when a branch moves
+        key = (self.repo.commit(ref).hexsha, path)
+        if key not in self.commits:
+            # None if this object is unknown at this reference
+            self.commits[key] = next(iter(self.repo.iter_commits(key[0], paths=path)), None)
 
-        # else this objectd is unknown at this reference; fall through to None
+        return self.commits[key]
 
 
     def prepare_path(self, id, prefix):
@@ -224,6 +353,75 @@ class Session():
         return '/'.join(path)
     
 
+    def write_csv(self, s, path, fmt=None):
+        '''Write a series to a CSV file with its index levels as the leading columns
+
+           s:        a pandas.Series, sorted and named as it should appear in the file
+
+           path:     output path
+
+           fmt:      float format string, or None to detect one from the values
+        '''
+
+        if fmt is None:
+            fmt = format_str(s)
+
+        # arrow formats floats differently from pandas (e.g. 2.0 as 2, or exponents), so to keep files
+        # identical it only writes series that are cast to integers throughout. Negative zeros (pandas
+        # writes -0) and missing keys (pandas writes an empty field, astype(str) gives 'nan') also go to pandas
+        data = None
+        if (fmt and pa is not None and (self.line_terminator or os.linesep) == '\n'
+                and not any(s.index.get_level_values(name).hasnans for name in s.index.names)
+                and not np.signbit(s[s == 0].to_numpy()).any()):
+            try:
+                columns = {name: pa.array(s.index.get_level_values(name).astype(str)) for name in s.index.names}
+                columns[s.name] = pc.cast(pa.array(s.to_numpy(), from_pandas=True), pa.int64())
+                tbl = pa.table(columns)
+
+                # render in memory first, so a value that can't be written unquoted doesn't leave a truncated file
+                sink = pa.BufferOutputStream()
+                pcsv.write_csv(tbl, sink, write_options=pcsv.WriteOptions(include_header=False, batch_size=8192, quoting_style='none'))
+                data = sink.getvalue()
+            except pa.ArrowInvalid:
+                # values too large for int64, or keys that need quoting: fall through to pandas
+                pass
+
+        if data is not None:
+            # write the header ourselves: arrow quotes column names
+            with open(path, 'wb', buffering=self.buffer_size) as fd:
+                fd.write((','.join(tbl.column_names) + '\n').encode())
+                fd.write(data)
+
+        else:
+            with open(path, 'w', buffering=self.buffer_size, newline='') as fd:
+                s.to_csv(fd, line_terminator=self.line_terminator, float_format=fmt)
+
+
+    def write_parquet(self, df, path, stamp):
+        '''Write the parquet copy of a CSV file
+
+           df:       the data frame parsed from the CSV
+
+           path:     path of the parquet copy
+
+           stamp:    size and mtime of the CSV, as returned by csv_stamp
+        '''
+
+        try:
+            tbl = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # e.g. mixed types in a column; just read the CSV next time
+            return
+
+        # keep the pandas metadata so the copy reads back with the same dtypes and index
+        tbl = tbl.replace_schema_metadata({**(tbl.schema.metadata or {}), **stamp})
+
+        # write to a temporary file first so concurrent readers never see a partial copy
+        tmp = '{}.{}-{}.tmp.parquet'.format(os.path.splitext(path)[0], os.getpid(), threading.get_ident())
+        pq.write_table(tbl, tmp, compression='zstd')
+        os.replace(tmp, path)
+
+
     def save(self, obj, id=None, prefix='data'):
         '''Save a pandas object to one or more CSV files in the repository
 
@@ -234,15 +432,6 @@ class Session():
            prefix:   path prefix
         '''
 
-        def format_str(s):
-
-            # pandas is sloppy about decimal points and integer values frequently get written as floats
-            # we try to correct for this by looking for remainders and if none, we specify a formatting string
-            if ((np.remainder(s, 1) == 0) | np.isnan(s)).all():
-                return '%.0f'
-
-            return None
-
         keys = ['series'] + self.keys
 
         if type(obj) is pd.DataFrame:
@@ -264,11 +453,12 @@ class Session():
             if id:
                 raise ValueError('id cannot be specified if series is included in MultiIndex')
 
-            for id in obj.index.get_level_values(0).unique():
-                xs = obj.xs(id).sort_index() # make sure these are sorted
+            # sort once up front so each group is a contiguous, already sorted slice
+            for id, xs in obj.sort_index().groupby(level=0, sort=False):
+                xs = xs.droplevel(0)
                 xs.name = 'value'
                 path = self.prepare_path(id, prefix)
-                xs.to_csv(path, line_terminator=self.line_terminator, float_format=format_str(xs))
+                self.write_csv(xs, path, self.formats.get(id.upper()))
 
         elif obj.index.names == self.keys:
             # in this case we save as is. 
@@ -278,7 +468,7 @@ class Session():
             
             path = self.prepare_path(id, prefix)
             xs.name = 'value'
-            xs.to_csv(path, line_terminator=self.line_terminator, float_format=format_str(xs))
+            self.write_csv(xs, path, self.formats.get(id.upper()))
 
         # we also support indexes that are simply in the wrong order
         # this won't be efficient if a DataFrame is passed, but that's easily fixed prior to saving
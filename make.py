@@ -34,9 +34,9 @@ Options:
 '''
 
 import decispy.dcs as dcs
+from decispy.git import format_str
 from docopt import docopt
 import pandas as pd
-import numpy as np
 import yaml
 import os
 import sys
@@ -111,11 +111,12 @@ if not config['--no-excludes']:
         if k in df.index.names:
             df.drop(v, level=k, errors='ignore', inplace=True)
 
-series = df.index.get_level_values(0).unique()
-for elem in series:
-    if config['--limit'] and config['--limit'] != elem:
-        continue
+if config['--limit']:
+    df = df[df.index.get_level_values(0) == config['--limit']]
 
+# sort once up front so each series is a contiguous, already sorted slice
+df = df.sort_index()
+for elem, xs in df.groupby(level=0, sort=False):
     # create the directory hierarchy as necessary
     if '.' in elem:
         path = 'data/{}'.format(elem.split('.')[0])
@@ -130,13 +131,7 @@ for elem in series:
     path = '{}/{}.csv'.format(path, elem)
     print('Writing {}'.format(path))
 
-    # pandas is sloppy about decimal points and integer values frequently get written as floats
-    # we try to correct for this by looking for remainders and if none, we specify a formatting string
-    xs = df.xs(elem)
-    s = xs.iloc[:,0]    # 1st column as a series
-    if ((np.remainder(s, 1) == 0) | np.isnan(s)).all():
-        fstr = '%.0f'
-    else:
-        fstr = None
+    xs = xs.droplevel(0)
+    fstr = format_str(xs.iloc[:,0])    # 1st column as a series
 
-    xs.sort_index().to_csv(path, line_terminator=config['--eol'], float_format=fstr)
+    xs.to_csv(path, line_terminator=config['--eol'], float_format=fstr)